@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for the backend API.
+
+gevent workers let the hundreds-of-milliseconds waits on Yahoo and
+PostgreSQL overlap instead of pinning a worker per request. The gevent
+worker class monkey-patches the socket layer itself; psycopg2 needs the
+psycogreen patch applied per worker below.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '5000')}"
+worker_class = 'gevent'
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+timeout = 30
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -3,25 +3,74 @@ Barebones Flask application for Golden Knight Lounge backend
 """
 import os
 from flask import Flask, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+from auth.auth_routes import init_auth
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson's native serializer."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Load environment variables
 load_dotenv()
 
+# Constant for the process lifetime - read once, not per request
+NODE_ENV = os.getenv('NODE_ENV', 'development')
+
 # Create Flask app
 app = Flask(__name__)
+app.secret_key = os.getenv('JWT_SECRET', 'dev-secret-key')
+
+# orjson serializes small dicts 2-5x faster than the stdlib encoder -
+# worthwhile on the frequently polled /auth/status and /api/health
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Server-side sessions in Redis when available (shared across workers,
+# smaller cookies); fall back to Flask's signed cookies otherwise.
+redis_url = os.getenv('REDIS_URL')
+if redis_url:
+    import redis
+    from flask_session import Session
+
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis.Redis.from_url(redis_url),
+        SESSION_USE_SIGNER=True,
+        SESSION_PERMANENT=False,
+        # Redis TTL - expired sessions (including stale OAuth state) are
+        # garbage-collected automatically.
+        PERMANENT_SESSION_LIFETIME=int(os.getenv('SESSION_LIFETIME_SECONDS',
+                                                 3600)),
+    )
+    Session(app)
 
 # Configure CORS
 allowed_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
 CORS(app, origins=allowed_origins)
 
+# Yahoo OAuth service
+init_auth(app)
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'environment': os.getenv('NODE_ENV', 'development'),
+        'environment': NODE_ENV,
         'message': 'Golden Knight Lounge Backend API'
     })
 
@@ -35,5 +84,7 @@ def root():
 
 if __name__ == '__main__':
     port = int(os.getenv('API_PORT', 5000))
-    debug = os.getenv('NODE_ENV', 'development') != 'production'
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    debug = NODE_ENV != 'production'
+    # threaded=True so a Yahoo OAuth round-trip in one request does not
+    # block every other request in the dev server
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
\ No newline at end of file
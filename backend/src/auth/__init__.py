@@ -0,0 +1,14 @@
+"""
+Yahoo OAuth authentication service for Golden Knight Lounge
+"""
+from .token_manager import TokenManager
+from .yahoo_oauth import YahooOAuthClient, YahooOAuthError, YahooAPIError
+from .auth_routes import init_auth
+
+__all__ = [
+    'TokenManager',
+    'YahooOAuthClient',
+    'YahooOAuthError',
+    'YahooAPIError',
+    'init_auth',
+]
@@ -0,0 +1,148 @@
+"""
+Flask routes for the Yahoo OAuth flow.
+"""
+import atexit
+import logging
+import os
+import secrets
+import time
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Blueprint, Flask, jsonify, redirect, request, session
+
+from .token_manager import TokenManager
+from .yahoo_oauth import YahooOAuthClient, YahooOAuthError
+
+logger = logging.getLogger(__name__)
+
+auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
+
+token_manager: TokenManager = None
+oauth_client: YahooOAuthClient = None
+_scheduler: BackgroundScheduler = None
+
+# Refresh tokens this many seconds before they expire
+REFRESH_WINDOW_SECONDS = 300
+
+# Effectively constant for the life of the process; resolved once in
+# init_auth (after dotenv has run) instead of per request.
+_success_redirect = '/'
+_environment = 'development'
+
+
+def init_auth(app: Flask) -> None:
+    """Wire the auth service into the Flask app."""
+    global token_manager, oauth_client, _success_redirect, _environment
+    token_manager = TokenManager()
+    oauth_client = YahooOAuthClient(token_manager=token_manager)
+    _success_redirect = os.getenv('AUTH_SUCCESS_REDIRECT', '/')
+    _environment = os.getenv('NODE_ENV', 'development')
+    app.register_blueprint(auth_bp)
+    _start_token_refresher()
+    logger.info('Auth service initialized')
+
+
+def _start_token_refresher() -> None:
+    """Start the background job that refreshes tokens before expiry."""
+    global _scheduler
+    if _scheduler is not None:
+        return
+    _scheduler = BackgroundScheduler()
+    _scheduler.add_job(_refresh_expiring_tokens, 'interval', seconds=60,
+                       id='yahoo-token-refresh')
+    _scheduler.add_job(_probe_connection, 'interval', seconds=30,
+                       id='yahoo-connection-probe')
+    _scheduler.start()
+    atexit.register(_scheduler.shutdown)
+
+
+def _refresh_expiring_tokens() -> None:
+    """Refresh stored tokens nearing expiry, off the request path."""
+    try:
+        tokens = token_manager.get_valid_tokens()
+        if (tokens and tokens.get('has_refresh_token')
+                and tokens['expires_at'] - time.time() < REFRESH_WINDOW_SECONDS):
+            oauth_client.refresh_access_token()
+            logger.info('Proactively refreshed Yahoo tokens')
+    except Exception:
+        logger.exception('Background token refresh failed')
+
+
+def _probe_connection() -> None:
+    """Keep the cached connection-health result warm for /auth/status."""
+    try:
+        if token_manager.status()['has_tokens']:
+            oauth_client.test_connection(max_age=0)
+    except Exception:
+        logger.exception('Background connection probe failed')
+
+
+@auth_bp.route('/login', methods=['GET'])
+def login():
+    """Start the OAuth flow by redirecting to Yahoo's consent page."""
+    state = secrets.token_urlsafe(32)
+    session['oauth_state'] = state
+    return redirect(oauth_client.get_authorization_url(state))
+
+
+@auth_bp.route('/callback', methods=['GET'])
+def callback():
+    """Handle the redirect back from Yahoo with the authorization code."""
+    error = request.args.get('error')
+    if error:
+        logger.warning('OAuth callback returned error: %s', error)
+        return jsonify({'error': f'Yahoo authorization failed: {error}'}), 400
+    state = request.args.get('state')
+    if not state or state != session.pop('oauth_state', None):
+        return jsonify({'error': 'Invalid OAuth state'}), 400
+    code = request.args.get('code')
+    if not code:
+        return jsonify({'error': 'Missing authorization code'}), 400
+    try:
+        data = oauth_client.exchange_code_for_token(code)
+    except YahooOAuthError as exc:
+        logger.error('Token exchange failed: %s', exc)
+        return jsonify({'error': str(exc)}), 502
+    session['authenticated'] = True
+    session['token_expires'] = time.time() + int(data.get('expires_in', 3600))
+    return redirect(_success_redirect)
+
+
+@auth_bp.route('/status', methods=['GET'])
+def status():
+    """Report authentication state for the frontend."""
+    info = token_manager.status()
+    expired = (not info['has_tokens']
+               or time.time() >= info['expires_at'] - 60)
+    connection_valid = False
+    if info['has_tokens'] and not expired:
+        connection_valid = oauth_client.test_connection()
+    return jsonify({
+        'authenticated': info['has_tokens'],
+        'token_expired': expired,
+        'has_refresh_token': info['has_refresh_token'],
+        'connection_valid': connection_valid,
+        'environment': _environment,
+    })
+
+
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """Force a token refresh."""
+    try:
+        data = oauth_client.refresh_access_token()
+    except YahooOAuthError as exc:
+        return jsonify({'error': str(exc)}), 400
+    session['token_expires'] = time.time() + int(data.get('expires_in', 3600))
+    return jsonify({
+        'status': 'refreshed',
+        'expires_in': data.get('expires_in'),
+    })
+
+
+@auth_bp.route('/logout', methods=['POST'])
+def logout():
+    """Delete stored tokens and clear the session."""
+    token_manager.delete_tokens()
+    session.clear()
+    return jsonify({'status': 'logged_out'})
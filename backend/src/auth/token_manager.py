@@ -0,0 +1,507 @@
+"""
+Encrypted storage for Yahoo OAuth tokens.
+
+Tokens are encrypted with AES-256-GCM before they touch storage (rows
+written by earlier versions used Fernet and are migrated on first
+read). Backends, in
+order of preference: Redis when REDIS_URL is configured (a hash per
+service, ~100us lookups), PostgreSQL through a shared connection pool
+when DATABASE_URL is configured, and an in-memory store so local
+development works without either.
+"""
+import atexit
+import base64
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
+
+import redis
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from psycopg2 import pool
+
+# Decrypt failures that mean "wrong key or corrupt row" (as opposed to
+# programming errors, which must propagate): AES-GCM's InvalidTag,
+# Fernet's InvalidToken, and ValueError for mangled base64.
+_DECRYPT_ERRORS: tuple = (InvalidTag, InvalidToken, ValueError)
+
+try:
+    # Rust-backed Fernet, ~4x faster decrypts when installed; only
+    # exercised on legacy rows written before the AES-GCM switch. Its
+    # API takes str keys/tokens, so the legacy cipher is fed str on
+    # both backends.
+    import rfernet
+    _LegacyFernet = rfernet.Fernet
+    _DECRYPT_ERRORS = _DECRYPT_ERRORS + (rfernet.DecryptionError,)
+except ImportError:
+    _LegacyFernet = Fernet
+
+logger = logging.getLogger(__name__)
+
+# GC horizon for abandoned Redis token hashes. Deliberately much longer
+# than the access-token lifetime: the refresh token in the same hash
+# stays valid long after expires_at.
+REDIS_TOKEN_TTL_SECONDS = 30 * 24 * 3600
+
+# Decoded/validated key bytes shared across TokenManager instances (and
+# across gunicorn --preload workers importing this module).
+_validated_keys: Dict[str, bytes] = {}
+
+# db_urls whose CREATE TABLE already ran in this process, so additional
+# instances skip the DDL round-trip.
+_ddl_completed: set = set()
+
+
+class TokenDecryptionError(Exception):
+    """Raised when a stored token cannot be decrypted with the current key."""
+
+
+@dataclass(slots=True)
+class TokenRecord:
+    """Encrypted token row for the in-memory backend.
+
+    Slots keep each record to fixed attribute storage instead of a
+    per-record dict, and attribute reads skip the key hashing a dict
+    lookup would do.
+    """
+
+    access_token: str
+    refresh_token: Optional[str]
+    expires_at: float
+    scope: str
+
+
+def _key_bytes_for(key: str) -> bytes:
+    """Decode and validate an encryption key once per process."""
+    key_bytes = _validated_keys.get(key)
+    if key_bytes is None:
+        key_bytes = base64.urlsafe_b64decode(key.encode())
+        if len(key_bytes) != 32:
+            raise ValueError('TOKEN_ENCRYPTION_KEY must decode to 32 bytes')
+        _validated_keys[key] = key_bytes
+    return key_bytes
+
+
+class TokenManager:
+    """Persists encrypted OAuth tokens and returns them decrypted."""
+
+    def __init__(self, db_url: Optional[str] = None,
+                 encryption_key: Optional[str] = None,
+                 redis_url: Optional[str] = None) -> None:
+        self.db_url = db_url or os.getenv('DATABASE_URL')
+        redis_url = redis_url or os.getenv('REDIS_URL')
+        self._redis: Optional[redis.Redis] = (
+            redis.Redis.from_url(redis_url, decode_responses=True)
+            if redis_url else None
+        )
+        key = encryption_key or os.getenv('TOKEN_ENCRYPTION_KEY')
+        if not key:
+            key = Fernet.generate_key().decode()
+            logger.warning(
+                'TOKEN_ENCRYPTION_KEY not set - generated an ephemeral key. '
+                'Stored tokens will not survive a restart.'
+            )
+        self.encryption_key = key
+        # The key keeps the Fernet format (urlsafe base64 of 32 bytes);
+        # AES-GCM uses the decoded raw bytes, Fernet stays around only to
+        # decrypt rows written before the switch. Validation is memoized
+        # at module scope and the ciphers build lazily on first use.
+        self._key_bytes = _key_bytes_for(key)
+        self._pool: Optional[pool.ThreadedConnectionPool] = None
+        self._memory_storage: Dict[str, TokenRecord] = {}
+        # Decrypted tokens cached per service; plaintext lives only in
+        # memory, storage stays encrypted at rest.
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache_lock = threading.Lock()
+        # Dirty rows waiting to be flushed to PostgreSQL; the cache is
+        # the source of truth between flushes. Each queued row carries a
+        # sequence number so a stale write (e.g. one re-queued after a
+        # failed flush) can never supersede a newer save or delete.
+        self._dirty: 'queue.Queue[Tuple[int, str, Optional[Tuple]]]' = (
+            queue.Queue()
+        )
+        self._write_seq = itertools.count(1)
+        self._applied_seq: Dict[str, int] = {}
+        # Serializes the drain-and-write section between the background
+        # flush thread and the inline flush in delete_tokens.
+        self._flush_lock = threading.Lock()
+        self._flush_interval = float(os.getenv('TOKEN_FLUSH_INTERVAL', '2'))
+        # Connections that already carry our server-side prepared
+        # statements; populated lazily once the table exists.
+        self._prepared_conns: set = set()
+        self._table_ready = False
+        self._db_lock = threading.Lock()
+        self._db_ready = False
+        if self._redis:
+            logger.info('Token storage initialized (Redis)')
+
+    @cached_property
+    def _aead(self) -> AESGCM:
+        return AESGCM(self._key_bytes)
+
+    @cached_property
+    def _fernet(self):
+        # str key: rfernet accepts only str, cryptography accepts both
+        return _LegacyFernet(self.encryption_key)
+
+    def _ensure_db(self) -> None:
+        """Create the pool (and table, once per process) on first use."""
+        if self._db_ready:
+            return
+        with self._db_lock:
+            if self._db_ready:
+                return
+            self._init_database()
+            flusher = threading.Thread(target=self._flush_loop,
+                                       name='token-flush', daemon=True)
+            flusher.start()
+            atexit.register(self._flush_dirty)
+            self._db_ready = True
+
+    @contextmanager
+    def _conn(self):
+        """Borrow a connection from the pool and return it when done."""
+        conn = self._pool.getconn()
+        try:
+            if self._table_ready and conn not in self._prepared_conns:
+                self._prepare_statements(conn)
+                self._prepared_conns.add(conn)
+            yield conn
+        finally:
+            self._pool.putconn(conn)
+
+    @staticmethod
+    def _prepare_statements(conn) -> None:
+        """PREPARE the hot queries server-side so EXECUTE skips parse+plan."""
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                PREPARE get_oauth_tokens (text) AS
+                SELECT access_token, refresh_token, expires_at, scope
+                FROM oauth_tokens
+                WHERE service = $1
+            ''')
+            cursor.execute('''
+                PREPARE upsert_oauth_tokens
+                    (text, text, text, double precision, text) AS
+                INSERT INTO oauth_tokens
+                    (service, access_token, refresh_token,
+                     expires_at, scope, updated_at)
+                VALUES ($1, $2, $3, $4, $5, NOW())
+                ON CONFLICT (service) DO UPDATE SET
+                    access_token = EXCLUDED.access_token,
+                    refresh_token = EXCLUDED.refresh_token,
+                    expires_at = EXCLUDED.expires_at,
+                    scope = EXCLUDED.scope,
+                    updated_at = NOW()
+            ''')
+            cursor.execute('''
+                PREPARE delete_oauth_tokens (text) AS
+                DELETE FROM oauth_tokens WHERE service = $1
+            ''')
+        conn.commit()
+
+    def _init_database(self) -> None:
+        """Create the connection pool and ensure the token table exists."""
+        self._pool = pool.ThreadedConnectionPool(1, 16, self.db_url)
+        if self.db_url in _ddl_completed:
+            self._table_ready = True
+            return
+        with self._conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS oauth_tokens (
+                        id SERIAL PRIMARY KEY,
+                        service VARCHAR(50) NOT NULL UNIQUE,
+                        access_token TEXT NOT NULL,
+                        refresh_token TEXT,
+                        expires_at DOUBLE PRECISION NOT NULL,
+                        scope TEXT,
+                        created_at TIMESTAMPTZ DEFAULT NOW(),
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                ''')
+                # No separate index on service: UNIQUE(service) already
+                # provides the btree used by the equality lookups.
+            conn.commit()
+        _ddl_completed.add(self.db_url)
+        self._table_ready = True
+        logger.info('Token storage initialized (PostgreSQL)')
+
+    def save_tokens(self, access_token: str, refresh_token: Optional[str],
+                    expires_in: int, scope: str = '',
+                    service: str = 'yahoo') -> None:
+        """Encrypt and store a token set for a service."""
+        expires_at = time.time() + expires_in
+        enc_access = self._encrypt(access_token)
+        enc_refresh = self._encrypt(refresh_token) if refresh_token else None
+        if self._redis:
+            key = f'oauth:{service}'
+            self._redis.hset(key, mapping={
+                'access_token': enc_access,
+                'refresh_token': enc_refresh or '',
+                'expires_at': expires_at,
+                'scope': scope,
+            })
+            self._redis.expire(key, REDIS_TOKEN_TTL_SECONDS)
+        elif self.db_url:
+            # Write-behind: enqueue the encrypted row and let the flush
+            # thread batch it; the cache updated below is authoritative
+            # until then.
+            self._ensure_db()
+            self._dirty.put(
+                (next(self._write_seq), service,
+                 (service, enc_access, enc_refresh, expires_at, scope))
+            )
+        else:
+            self._memory_storage[service] = TokenRecord(
+                access_token=enc_access,
+                refresh_token=enc_refresh,
+                expires_at=expires_at,
+                scope=scope,
+            )
+        with self._cache_lock:
+            self._cache[service] = {
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'refresh_token_enc': enc_refresh,
+                'expires_at': expires_at,
+                'scope': scope,
+            }
+        logger.info('Saved tokens for service %s (expires in %ss)',
+                    service, expires_in)
+
+    def _read_row(self, service: str) -> Optional[Tuple]:
+        """Read the encrypted (access, refresh, expires_at, scope) row."""
+        if self._redis:
+            data = self._redis.hgetall(f'oauth:{service}')
+            if not data:
+                return None
+            return (data['access_token'], data['refresh_token'] or None,
+                    float(data['expires_at']), data['scope'])
+        if self.db_url:
+            self._ensure_db()
+            with self._conn() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('EXECUTE get_oauth_tokens (%s)', (service,))
+                    row = cursor.fetchone()
+            return row or None
+        stored = self._memory_storage.get(service)
+        if not stored:
+            return None
+        return (stored.access_token, stored.refresh_token,
+                stored.expires_at, stored.scope)
+
+    def _encrypt(self, token: str) -> str:
+        """Encrypt with AES-GCM: base64(nonce || ciphertext || tag)."""
+        nonce = os.urandom(12)
+        ciphertext = self._aead.encrypt(nonce, token.encode(), None)
+        return 'gcm:' + base64.urlsafe_b64encode(nonce + ciphertext).decode()
+
+    def _decrypt(self, value) -> str:
+        if isinstance(value, bytes):
+            value = value.decode()
+        try:
+            if value.startswith('gcm:'):
+                raw = base64.urlsafe_b64decode(value[4:])
+                return self._aead.decrypt(raw[:12], raw[12:], None).decode()
+            # Row written before the AES-GCM switch; str token for
+            # rfernet compatibility, cryptography accepts it too
+            return self._fernet.decrypt(value).decode()
+        except _DECRYPT_ERRORS as exc:
+            # Typically a row written under a different key (e.g. an
+            # ephemeral one from a restart without TOKEN_ENCRYPTION_KEY).
+            # Deliberately narrow: a programming error like a TypeError
+            # must propagate, not get a valid row deleted.
+            raise TokenDecryptionError(str(exc)) from exc
+
+    @staticmethod
+    def _is_legacy(value) -> bool:
+        if isinstance(value, bytes):
+            value = value.decode()
+        return not value.startswith('gcm:')
+
+    @staticmethod
+    def _public_view(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'access_token': entry['access_token'],
+            'expires_at': entry['expires_at'],
+            'scope': entry['scope'],
+            'has_refresh_token': bool(entry['refresh_token']
+                                      or entry['refresh_token_enc']),
+        }
+
+    def get_valid_tokens(self, service: str = 'yahoo') -> Optional[Dict[str, Any]]:
+        """Return the decrypted access token plus metadata for a service.
+
+        The refresh token is not decrypted here - it is only needed on
+        expiry, so use get_refresh_token() at that point. The returned
+        dict carries has_refresh_token for cheap existence checks.
+        """
+        with self._cache_lock:
+            cached = self._cache.get(service)
+            if cached and time.time() < cached['expires_at'] - 60:
+                return self._public_view(cached)
+        row = self._read_row(service)
+        if row is None:
+            return None
+        enc_access, enc_refresh, expires_at, scope = row
+        try:
+            if self._is_legacy(enc_access):
+                # One-shot migration: rewrite the Fernet row as AES-GCM
+                logger.info('Re-encrypting legacy Fernet tokens for %s',
+                            service)
+                self.save_tokens(
+                    access_token=self._decrypt(enc_access),
+                    refresh_token=(self._decrypt(enc_refresh)
+                                   if enc_refresh else None),
+                    expires_in=int(expires_at - time.time()),
+                    scope=scope,
+                    service=service,
+                )
+                with self._cache_lock:
+                    return self._public_view(self._cache[service])
+            entry = {
+                'access_token': self._decrypt(enc_access),
+                'refresh_token': None,
+                'refresh_token_enc': enc_refresh,
+                'expires_at': expires_at,
+                'scope': scope,
+            }
+        except TokenDecryptionError:
+            # Treat as unauthenticated rather than erroring every caller;
+            # drop the dead row so the user is sent back through OAuth.
+            logger.warning('Stored tokens for %s cannot be decrypted with '
+                           'the current key - clearing them', service)
+            self.delete_tokens(service)
+            return None
+        with self._cache_lock:
+            self._cache[service] = entry
+        return self._public_view(entry)
+
+    def status(self, service: str = 'yahoo') -> Dict[str, Any]:
+        """Cheap existence/expiry check that never touches the cipher."""
+        with self._cache_lock:
+            entry = self._cache.get(service)
+            if entry:
+                return {
+                    'has_tokens': True,
+                    'expires_at': entry['expires_at'],
+                    'has_refresh_token': bool(entry['refresh_token']
+                                              or entry['refresh_token_enc']),
+                }
+        row = self._read_row(service)
+        if row is None:
+            return {'has_tokens': False, 'expires_at': None,
+                    'has_refresh_token': False}
+        _, enc_refresh, expires_at, _ = row
+        return {
+            'has_tokens': True,
+            'expires_at': expires_at,
+            'has_refresh_token': bool(enc_refresh),
+        }
+
+    def get_refresh_token(self, service: str = 'yahoo') -> Optional[str]:
+        """Decrypt and return the refresh token on demand."""
+        with self._cache_lock:
+            entry = self._cache.get(service)
+        if entry is None:
+            if self.get_valid_tokens(service) is None:
+                return None
+            with self._cache_lock:
+                entry = self._cache[service]
+        if entry['refresh_token']:
+            return entry['refresh_token']
+        if not entry['refresh_token_enc']:
+            return None
+        try:
+            refresh_token = self._decrypt(entry['refresh_token_enc'])
+        except TokenDecryptionError:
+            logger.warning('Stored refresh token for %s cannot be decrypted '
+                           'with the current key', service)
+            return None
+        with self._cache_lock:
+            entry['refresh_token'] = refresh_token
+        return refresh_token
+
+    def delete_tokens(self, service: str = 'yahoo') -> None:
+        """Remove stored tokens for a service."""
+        if self._redis:
+            self._redis.delete(f'oauth:{service}')
+        elif self.db_url:
+            # A None row marks deletion; flush immediately so logout
+            # takes effect and supersedes any queued saves.
+            self._ensure_db()
+            self._dirty.put((next(self._write_seq), service, None))
+            self._flush_dirty()
+        else:
+            self._memory_storage.pop(service, None)
+        with self._cache_lock:
+            self._cache.pop(service, None)
+        logger.info('Deleted tokens for service %s', service)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self._flush_interval)
+            self._flush_dirty()
+
+    def _flush_dirty(self) -> None:
+        """Write queued token rows to PostgreSQL, last write per service.
+
+        Runs from the background flush thread and inline from
+        delete_tokens; the lock keeps those drains serialized so an
+        in-flight save cannot commit after (and undo) a logout DELETE.
+        """
+        with self._flush_lock:
+            pending: Dict[str, Tuple[int, Optional[Tuple]]] = {}
+            while True:
+                try:
+                    seq, service, row = self._dirty.get_nowait()
+                except queue.Empty:
+                    break
+                if service not in pending or seq > pending[service][0]:
+                    pending[service] = (seq, row)
+            # Drop anything already superseded by a flushed write
+            pending = {
+                service: (seq, row) for service, (seq, row) in pending.items()
+                if seq > self._applied_seq.get(service, 0)
+            }
+            if not pending or not self._pool:
+                return
+            try:
+                with self._conn() as conn:
+                    with conn.cursor() as cursor:
+                        for service, (seq, row) in pending.items():
+                            if row is None:
+                                cursor.execute(
+                                    'EXECUTE delete_oauth_tokens (%s)',
+                                    (service,)
+                                )
+                            else:
+                                cursor.execute(
+                                    'EXECUTE upsert_oauth_tokens '
+                                    '(%s, %s, %s, %s, %s)', row
+                                )
+                    conn.commit()
+                for service, (seq, _) in pending.items():
+                    self._applied_seq[service] = seq
+            except Exception:
+                logger.exception(
+                    'Token flush failed - will retry next interval')
+                for service, (seq, row) in pending.items():
+                    self._dirty.put((seq, service, row))
+
+    def is_token_expired(self, service: str = 'yahoo',
+                         buffer_seconds: int = 60) -> bool:
+        """Check whether the stored access token is expired or near expiry."""
+        tokens = self.get_valid_tokens(service)
+        if not tokens:
+            return True
+        return time.time() >= tokens['expires_at'] - buffer_seconds
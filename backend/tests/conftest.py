@@ -0,0 +1,87 @@
+"""
+Shared test setup: sys.path wiring and fixtures used across test modules.
+
+Putting the path insert here means pytest collection (and each xdist
+worker) resolves the backend import graph once instead of per file.
+"""
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+@pytest.fixture(scope='session')
+def encryption_key():
+    return Fernet.generate_key().decode()
+
+
+class FakeCursor:
+    """Hand-rolled cursor fake - plain attribute access is an order of
+    magnitude cheaper than MagicMock's __getattr__ dispatch.
+
+    last_execute holds just the most recent statement; prefer it over
+    scanning execute_calls when that is all the assertion needs.
+    """
+
+    __slots__ = ('execute_calls', 'last_execute', 'fetchone_result')
+
+    def __init__(self):
+        self.execute_calls = []
+        self.last_execute = (None, None)
+        self.fetchone_result = None
+
+    def execute(self, query, params=None):
+        self.last_execute = (query, params)
+        self.execute_calls.append((query, params))
+
+    def fetchone(self):
+        return self.fetchone_result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def getconn(self):
+        return self._conn
+
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def mock_db_connection():
+    # Function-scoped on purpose: each test needs a clean DDL gate and an
+    # empty call log.
+    import auth.token_manager as token_manager_module
+    token_manager_module._ddl_completed.clear()
+    cursor = FakeCursor()
+    conn = FakeConn(cursor)
+    with patch('auth.token_manager.pool.ThreadedConnectionPool',
+               return_value=FakePool(conn)):
+        yield conn, cursor
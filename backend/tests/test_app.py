@@ -0,0 +1,38 @@
+"""
+Tests for the Flask application setup.
+"""
+import pytest
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    from app import app
+    app.config['TESTING'] = True
+    with app.test_client() as test_client:
+        yield test_client
+
+
+def test_health_check(client):
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'healthy'
+
+
+def test_root(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'version' in response.get_json()
+
+
+def test_orjson_provider_active(client):
+    pytest.importorskip('orjson')
+    from app import app
+    assert type(app.json).__name__ == 'OrjsonProvider'
+
+
+def test_cookie_sessions_without_redis(client):
+    # Without REDIS_URL the app must not require flask-session/redis
+    from app import app
+    assert app.config.get('SESSION_TYPE') != 'redis'
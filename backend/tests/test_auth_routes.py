@@ -0,0 +1,93 @@
+"""
+Tests for the /auth Flask routes and background token refresh.
+"""
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+
+import auth.auth_routes as auth_routes
+
+
+@pytest.fixture
+def mock_auth(monkeypatch):
+    manager = MagicMock()
+    client = MagicMock()
+    monkeypatch.setattr(auth_routes, 'token_manager', manager)
+    monkeypatch.setattr(auth_routes, 'oauth_client', client)
+    return manager, client
+
+
+@pytest.fixture
+def client(mock_auth):
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+    app.register_blueprint(auth_routes.auth_bp)
+    app.config['TESTING'] = True
+    with app.test_client() as test_client:
+        yield test_client
+
+
+def test_login_redirects_to_yahoo(client, mock_auth):
+    _, oauth_client = mock_auth
+    oauth_client.get_authorization_url.return_value = 'https://yahoo/auth'
+    response = client.get('/auth/login')
+    assert response.status_code == 302
+    assert response.location == 'https://yahoo/auth'
+
+
+def test_status_unauthenticated(client, mock_auth):
+    manager, _ = mock_auth
+    manager.status.return_value = {
+        'has_tokens': False,
+        'expires_at': None,
+        'has_refresh_token': False,
+    }
+    data = client.get('/auth/status').get_json()
+    assert data['authenticated'] is False
+    assert data['token_expired'] is True
+
+
+def test_status_authenticated_skips_decryption(client, mock_auth):
+    manager, oauth_client = mock_auth
+    manager.status.return_value = {
+        'has_tokens': True,
+        'expires_at': time.time() + 3600,
+        'has_refresh_token': True,
+    }
+    oauth_client.test_connection.return_value = True
+    data = client.get('/auth/status').get_json()
+    assert data['authenticated'] is True
+    assert data['token_expired'] is False
+    assert data['connection_valid'] is True
+    manager.get_valid_tokens.assert_not_called()
+
+
+def test_logout_deletes_tokens(client, mock_auth):
+    manager, _ = mock_auth
+    response = client.post('/auth/logout')
+    assert response.status_code == 200
+    manager.delete_tokens.assert_called_once()
+
+
+def test_refresh_expiring_tokens_refreshes(mock_auth):
+    manager, oauth_client = mock_auth
+    manager.get_valid_tokens.return_value = {
+        'access_token': 'a',
+        'has_refresh_token': True,
+        'expires_at': time.time() + 100,
+    }
+    auth_routes._refresh_expiring_tokens()
+    oauth_client.refresh_access_token.assert_called_once_with()
+
+
+def test_refresh_expiring_tokens_skips_fresh(mock_auth):
+    manager, oauth_client = mock_auth
+    manager.get_valid_tokens.return_value = {
+        'access_token': 'a',
+        'has_refresh_token': True,
+        'expires_at': time.time() + 3600,
+    }
+    auth_routes._refresh_expiring_tokens()
+    oauth_client.refresh_access_token.assert_not_called()
@@ -0,0 +1,401 @@
+"""
+Unit tests for TokenManager.
+"""
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from freezegun import freeze_time
+
+from auth.token_manager import TokenManager, TokenRecord
+
+
+def _legacy_token(manager, plaintext: bytes) -> str:
+    """Encrypt with the legacy cipher, normalizing the backends' return
+    types (rfernet yields str, cryptography yields bytes)."""
+    token = manager._fernet.encrypt(plaintext)
+    return token if isinstance(token, str) else token.decode()
+
+
+@pytest.fixture(scope='module')
+def _shared_manager(encryption_key):
+    with patch.dict(os.environ):
+        os.environ.pop('DATABASE_URL', None)
+        os.environ.pop('REDIS_URL', None)
+        manager = TokenManager(encryption_key=encryption_key)
+    return manager
+
+
+@pytest.fixture
+def token_manager_memory(_shared_manager):
+    # Reuse one manager (key validation + cipher setup are the expensive
+    # part) and just reset its state between tests
+    _shared_manager._memory_storage.clear()
+    _shared_manager._cache.clear()
+    return _shared_manager
+
+
+class TestTokenManagerMemory:
+    def test_save_tokens_memory(self, token_manager_memory):
+        token_manager_memory.save_tokens(
+            access_token='access-123',
+            refresh_token='refresh-456',
+            expires_in=3600,
+            scope='read write',
+        )
+        stored = token_manager_memory._memory_storage['yahoo']
+        assert stored.access_token != 'access-123'
+        assert stored.refresh_token != 'refresh-456'
+        assert stored.scope == 'read write'
+
+    @freeze_time('2025-01-01')
+    def test_get_valid_tokens_memory(self, token_manager_memory):
+        token_manager_memory.save_tokens(
+            access_token='access-123',
+            refresh_token='refresh-456',
+            expires_in=3600,
+        )
+        tokens = token_manager_memory.get_valid_tokens()
+        assert tokens['access_token'] == 'access-123'
+        assert tokens['has_refresh_token'] is True
+        assert tokens['expires_at'] == time.time() + 3600
+        assert token_manager_memory.get_refresh_token() == 'refresh-456'
+
+    def test_get_valid_tokens_missing(self, token_manager_memory):
+        assert token_manager_memory.get_valid_tokens() is None
+
+    def test_delete_tokens_memory(self, token_manager_memory):
+        token_manager_memory.save_tokens('a', 'r', 3600)
+        token_manager_memory.delete_tokens()
+        assert token_manager_memory.get_valid_tokens() is None
+
+    def test_encryption_decryption(self, token_manager_memory):
+        token_manager_memory.save_tokens('secret-token', None, 3600)
+        stored = token_manager_memory._memory_storage['yahoo']
+        assert 'secret-token' not in stored.access_token
+        tokens = token_manager_memory.get_valid_tokens()
+        assert tokens['access_token'] == 'secret-token'
+        assert tokens['has_refresh_token'] is False
+        assert token_manager_memory.get_refresh_token() is None
+
+    @freeze_time('2025-01-01')
+    def test_is_token_expired_expired(self, token_manager_memory):
+        token_manager_memory.save_tokens('a', 'r', expires_in=-100)
+        assert token_manager_memory.is_token_expired() is True
+
+    @freeze_time('2025-01-01')
+    def test_is_token_expired_valid(self, token_manager_memory):
+        token_manager_memory.save_tokens('a', 'r', expires_in=3600)
+        assert token_manager_memory.is_token_expired() is False
+
+    def test_is_token_expired_crossing_deadline(self, token_manager_memory):
+        # Freezegun lets the clock jump past expiry without sleeping
+        with freeze_time('2025-01-01') as clock:
+            token_manager_memory.save_tokens('a', 'r', expires_in=3600)
+            assert token_manager_memory.is_token_expired() is False
+            clock.tick(3700)
+            assert token_manager_memory.is_token_expired() is True
+
+    def test_is_token_expired_no_tokens(self, token_manager_memory):
+        assert token_manager_memory.is_token_expired() is True
+
+    def test_decrypt_runs_once_across_repeated_reads(self,
+                                                     token_manager_memory):
+        token_manager_memory.save_tokens('access-123', 'refresh-456', 3600)
+        token_manager_memory._cache.clear()
+        with patch.object(token_manager_memory, '_decrypt',
+                          wraps=token_manager_memory._decrypt) as spy:
+            first = token_manager_memory.get_valid_tokens()
+            second = token_manager_memory.get_valid_tokens()
+        assert first['access_token'] == second['access_token'] == 'access-123'
+        assert spy.call_count == 1
+
+    def test_status_never_decrypts(self, token_manager_memory):
+        token_manager_memory.save_tokens('a', 'r', 3600)
+        token_manager_memory._cache.clear()
+        with patch.object(token_manager_memory, '_decrypt') as mock_decrypt:
+            info = token_manager_memory.status()
+        assert info['has_tokens'] is True
+        assert info['has_refresh_token'] is True
+        mock_decrypt.assert_not_called()
+
+    def test_status_no_tokens(self, token_manager_memory):
+        info = token_manager_memory.status()
+        assert info == {'has_tokens': False, 'expires_at': None,
+                        'has_refresh_token': False}
+
+    def test_refresh_token_decrypted_lazily(self, token_manager_memory):
+        token_manager_memory.save_tokens('access-123', 'refresh-456', 3600)
+        token_manager_memory._cache.clear()
+        with patch.object(token_manager_memory, '_decrypt',
+                          wraps=token_manager_memory._decrypt) as spy:
+            token_manager_memory.get_valid_tokens()
+            assert spy.call_count == 1
+            assert token_manager_memory.get_refresh_token() == 'refresh-456'
+            assert spy.call_count == 2
+            # Subsequent reads reuse the cached plaintext
+            token_manager_memory.get_refresh_token()
+            assert spy.call_count == 2
+
+    def test_legacy_fernet_tokens_migrated(self, token_manager_memory):
+        token_manager_memory._memory_storage['yahoo'] = TokenRecord(
+            access_token=_legacy_token(token_manager_memory, b'access-123'),
+            refresh_token=_legacy_token(token_manager_memory, b'refresh-456'),
+            expires_at=time.time() + 3600,
+            scope='read',
+        )
+        tokens = token_manager_memory.get_valid_tokens()
+        assert tokens['access_token'] == 'access-123'
+        stored = token_manager_memory._memory_storage['yahoo']
+        assert stored.access_token.startswith('gcm:')
+        assert token_manager_memory.get_refresh_token() == 'refresh-456'
+
+    def test_key_decoded_once_and_ciphers_persist(self, token_manager_memory,
+                                                  encryption_key):
+        import base64
+        expected = base64.urlsafe_b64decode(encryption_key.encode())
+        assert token_manager_memory._key_bytes == expected
+        # cached_property: the same cipher objects come back every time
+        assert token_manager_memory._aead is token_manager_memory._aead
+        assert token_manager_memory._fernet is token_manager_memory._fernet
+
+    def test_undecryptable_row_treated_as_missing(self, encryption_key,
+                                                  monkeypatch):
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+        monkeypatch.delenv('TOKEN_ENCRYPTION_KEY', raising=False)
+        # Writer uses an ephemeral key, reader the configured one - the
+        # post-restart scenario when TOKEN_ENCRYPTION_KEY is unset
+        writer = TokenManager()
+        writer.save_tokens('access-123', 'refresh-456', 3600)
+        reader = TokenManager(encryption_key=encryption_key)
+        reader._memory_storage = writer._memory_storage
+        assert reader.get_valid_tokens() is None
+        assert reader.get_refresh_token() is None
+        # The dead row was cleared so the OAuth flow can start clean
+        assert 'yahoo' not in reader._memory_storage
+
+    def test_undecryptable_legacy_row_treated_as_missing(self, encryption_key,
+                                                         monkeypatch):
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+        monkeypatch.delenv('TOKEN_ENCRYPTION_KEY', raising=False)
+        writer = TokenManager()
+        reader = TokenManager(encryption_key=encryption_key)
+        reader._memory_storage['yahoo'] = TokenRecord(
+            access_token=_legacy_token(writer, b'access-123'),
+            refresh_token=None,
+            expires_at=time.time() + 3600,
+            scope='',
+        )
+        assert reader.get_valid_tokens() is None
+        assert 'yahoo' not in reader._memory_storage
+
+    def test_generates_key_when_missing(self, monkeypatch):
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+        monkeypatch.delenv('TOKEN_ENCRYPTION_KEY', raising=False)
+        manager = TokenManager()
+        manager.save_tokens('a', 'r', 3600)
+        assert manager.get_valid_tokens()['access_token'] == 'a'
+
+
+class FakeRedis:
+    """Minimal stand-in for redis.Redis covering the hash operations."""
+
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+
+    def hset(self, key, mapping):
+        self.store.setdefault(key, {}).update(
+            {k: str(v) for k, v in mapping.items()})
+
+    def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+@pytest.fixture
+def token_manager_redis(encryption_key):
+    fake = FakeRedis()
+    with patch('auth.token_manager.redis.Redis.from_url', return_value=fake):
+        manager = TokenManager(encryption_key=encryption_key,
+                               redis_url='redis://test')
+    return manager, fake
+
+
+class TestTokenManagerRedis:
+    def test_save_and_get_tokens_redis(self, token_manager_redis):
+        manager, fake = token_manager_redis
+        manager.save_tokens('access-123', 'refresh-456', 3600, 'read')
+        assert fake.store['oauth:yahoo']['access_token'] != 'access-123'
+        manager._cache.clear()
+        tokens = manager.get_valid_tokens()
+        assert tokens['access_token'] == 'access-123'
+        assert manager.get_refresh_token() == 'refresh-456'
+
+    def test_redis_ttl_set(self, token_manager_redis):
+        manager, fake = token_manager_redis
+        manager.save_tokens('a', 'r', 3600)
+        assert fake.ttls['oauth:yahoo'] > 3600
+
+    def test_delete_tokens_redis(self, token_manager_redis):
+        manager, fake = token_manager_redis
+        manager.save_tokens('a', 'r', 3600)
+        manager.delete_tokens()
+        assert 'oauth:yahoo' not in fake.store
+        assert manager.get_valid_tokens() is None
+
+
+class TestTokenManagerDatabase:
+    def test_init_database_creates_table(self, mock_db_connection,
+                                         encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        # Pool and DDL are lazy - nothing touches the DB until first use
+        assert not cursor.execute_calls
+        manager.get_valid_tokens()
+        statements = [q for q, _ in cursor.execute_calls]
+        assert any('CREATE TABLE' in s for s in statements)
+
+    def test_ciphers_built_lazily(self, encryption_key, monkeypatch):
+        # Needs a fresh instance - the shared fixture has already built its
+        # ciphers by the time this test runs
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+        manager = TokenManager(encryption_key=encryption_key)
+        assert '_aead' not in manager.__dict__
+        manager.save_tokens('a', 'r', 3600)
+        assert '_aead' in manager.__dict__
+
+    def test_save_tokens_database(self, mock_db_connection, encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.save_tokens('access-123', 'refresh-456', 3600, 'read')
+        manager._flush_dirty()
+        # A save is exactly one write statement: the prepared UPSERT,
+        # which is also the last thing on the wire. (Everything else on
+        # the log is first-use DDL and PREPAREs.)
+        writes = [q for q, _ in cursor.execute_calls
+                  if 'EXECUTE upsert_oauth_tokens' in q]
+        assert len(writes) == 1
+        query, params = cursor.last_execute
+        assert 'EXECUTE upsert_oauth_tokens' in query
+        assert params[0] == 'yahoo'
+        prepares = [q for q, _ in cursor.execute_calls
+                    if 'PREPARE upsert_oauth_tokens' in q]
+        assert len(prepares) == 1
+        assert 'ON CONFLICT (service) DO UPDATE' in prepares[0]
+
+    def test_save_tokens_is_write_behind(self, mock_db_connection,
+                                         encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.get_valid_tokens()
+        queries_after_init = len(cursor.execute_calls)
+        manager.save_tokens('access-123', 'refresh-456', 3600)
+        # The row is queued, not written inline; the cache serves reads
+        assert len(cursor.execute_calls) == queries_after_init
+        assert manager.get_valid_tokens()['access_token'] == 'access-123'
+
+    def test_flush_coalesces_latest_save(self, mock_db_connection,
+                                         encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.save_tokens('first', 'r1', 3600)
+        manager.save_tokens('second', 'r2', 3600)
+        manager._flush_dirty()
+        upserts = [q for q, _ in cursor.execute_calls
+                   if 'EXECUTE upsert_oauth_tokens' in q]
+        assert len(upserts) == 1
+
+    def test_stale_requeued_row_never_overwrites_newer_write(
+            self, mock_db_connection, encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.save_tokens('current', 'r1', 3600)
+        manager._flush_dirty()
+        flushed = len([q for q, _ in cursor.execute_calls
+                       if 'EXECUTE upsert_oauth_tokens' in q])
+        assert flushed == 1
+        # Simulate a row re-queued after a failed flush: its sequence
+        # number predates the applied write, so it must be dropped
+        stale_row = ('yahoo', 'enc-stale', None, time.time() + 3600, '')
+        manager._dirty.put((0, 'yahoo', stale_row))
+        manager._flush_dirty()
+        upserts = [q for q, _ in cursor.execute_calls
+                   if 'EXECUTE upsert_oauth_tokens' in q]
+        assert len(upserts) == 1
+
+    def test_get_valid_tokens_database(self, mock_db_connection,
+                                       encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        enc_access = manager._encrypt('access-123')
+        enc_refresh = manager._encrypt('refresh-456')
+        cursor.fetchone_result = (
+            enc_access, enc_refresh, time.time() + 3600, 'read'
+        )
+        tokens = manager.get_valid_tokens()
+        assert tokens['access_token'] == 'access-123'
+        assert tokens['scope'] == 'read'
+        assert manager.get_refresh_token() == 'refresh-456'
+
+    def test_get_valid_tokens_database_missing(self, mock_db_connection,
+                                               encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        assert manager.get_valid_tokens() is None
+
+    def test_get_valid_tokens_uses_cache(self, mock_db_connection,
+                                         encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        enc_access = manager._encrypt('access-123')
+        cursor.fetchone_result = (
+            enc_access, None, time.time() + 3600, ''
+        )
+        manager.get_valid_tokens()
+        queries_after_first = len(cursor.execute_calls)
+        tokens = manager.get_valid_tokens()
+        assert tokens['access_token'] == 'access-123'
+        assert len(cursor.execute_calls) == queries_after_first
+
+    def test_cache_invalidated_on_delete(self, token_manager_memory):
+        token_manager_memory.save_tokens('a', 'r', 3600)
+        assert token_manager_memory.get_valid_tokens() is not None
+        token_manager_memory.delete_tokens()
+        assert token_manager_memory.get_valid_tokens() is None
+
+    def test_delete_tokens_database(self, mock_db_connection, encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.delete_tokens()
+        query, params = cursor.last_execute
+        assert 'EXECUTE delete_oauth_tokens' in query
+        assert params == ('yahoo',)
+
+    def test_statements_prepared_once_per_connection(self, mock_db_connection,
+                                                     encryption_key):
+        _, cursor = mock_db_connection
+        manager = TokenManager(db_url='postgresql://test',
+                               encryption_key=encryption_key)
+        manager.get_valid_tokens()
+        manager.get_valid_tokens()
+        prepares = [q for q, _ in cursor.execute_calls
+                    if q.strip().startswith('PREPARE')]
+        assert len(prepares) == 3
+        upsert_prepare = next(p for p in prepares if 'INSERT INTO' in p)
+        assert 'ON CONFLICT (service) DO UPDATE' in upsert_prepare
@@ -0,0 +1,281 @@
+"""
+Unit tests for YahooOAuthClient with mocked Yahoo API responses.
+"""
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from auth.yahoo_oauth import (
+    YahooAPIError,
+    YahooOAuthClient,
+    YahooOAuthError,
+)
+
+TOKEN_RESPONSE = {
+    'access_token': 'new-access',
+    'refresh_token': 'new-refresh',
+    'expires_in': 3600,
+    'token_type': 'bearer',
+}
+
+
+@pytest.fixture
+def mock_token_manager():
+    return MagicMock()
+
+
+@pytest.fixture
+def oauth_client(mock_token_manager):
+    return YahooOAuthClient(
+        token_manager=mock_token_manager,
+        client_id='client-id',
+        client_secret='client-secret',
+        redirect_uri='https://example.com/auth/callback',
+    )
+
+
+def _mock_response(status_code=200, json_data=None, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    # Cover both decode paths: orjson reads .content, the stdlib
+    # fallback goes through .json()
+    response.json.return_value = json_data or {}
+    response.content = json.dumps(json_data or {}).encode()
+    response.headers = headers or {}
+    return response
+
+
+class TestSessionConfig:
+    def test_session_uses_keepalive_pool(self, oauth_client):
+        adapter = oauth_client._session.get_adapter(
+            'https://fantasysports.yahooapis.com')
+        assert adapter._pool_maxsize == 100
+
+    def test_session_retries_transient_errors(self, oauth_client):
+        adapter = oauth_client._session.get_adapter(
+            'https://fantasysports.yahooapis.com')
+        assert adapter.max_retries.total == 3
+        assert 429 in adapter.max_retries.status_forcelist
+
+    def test_session_shared_across_clients(self, oauth_client,
+                                           mock_token_manager):
+        other = YahooOAuthClient(
+            token_manager=mock_token_manager,
+            client_id='other-id',
+            client_secret='other-secret',
+            redirect_uri='https://example.com/auth/callback',
+        )
+        assert other._session is oauth_client._session
+
+
+class TestAuthorizationUrl:
+    def test_get_authorization_url_contains_params(self, oauth_client):
+        url = oauth_client.get_authorization_url()
+        assert url.startswith(
+            'https://api.login.yahoo.com/oauth2/request_auth?')
+        assert 'client_id=client-id' in url
+        assert 'response_type=code' in url
+
+    def test_get_authorization_url_with_state(self, oauth_client):
+        url = oauth_client.get_authorization_url(state='abc123')
+        assert 'state=abc123' in url
+
+
+class TestTokenExchange:
+    def test_exchange_code_for_token_success(self, oauth_client,
+                                             mock_token_manager):
+        with patch.object(oauth_client._session, 'post',
+                          return_value=_mock_response(200, TOKEN_RESPONSE)):
+            data = oauth_client.exchange_code_for_token('auth-code')
+        assert data['access_token'] == 'new-access'
+        mock_token_manager.save_tokens.assert_called_once()
+
+    def test_exchange_code_for_token_failure(self, oauth_client):
+        with patch.object(oauth_client._session, 'post',
+                          return_value=_mock_response(400)):
+            with pytest.raises(YahooOAuthError):
+                oauth_client.exchange_code_for_token('bad-code')
+
+    def test_refresh_access_token_success(self, oauth_client,
+                                          mock_token_manager):
+        with patch.object(oauth_client._session, 'post',
+                          return_value=_mock_response(200, TOKEN_RESPONSE)):
+            data = oauth_client.refresh_access_token('old-refresh')
+        assert data['access_token'] == 'new-access'
+        mock_token_manager.save_tokens.assert_called_once()
+
+    def test_refresh_access_token_single_flight(self, oauth_client):
+        release = threading.Event()
+
+        def slow_post(*args, **kwargs):
+            release.wait(timeout=5)
+            return _mock_response(200, TOKEN_RESPONSE)
+
+        results = []
+        with patch.object(oauth_client._session, 'post',
+                          side_effect=slow_post) as mock_post:
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    oauth_client.refresh_access_token('old-refresh')))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join(timeout=5)
+        assert mock_post.call_count == 1
+        assert len(results) == 3
+        assert all(r['access_token'] == 'new-access' for r in results)
+
+    def test_waiter_ignores_result_of_previous_refresh(self, oauth_client):
+        # A completed earlier refresh left its result behind; a waiter
+        # arriving during a new (failing) refresh must not pick it up
+        oauth_client._refresh_result = {'access_token': 'stale'}
+        oauth_client._refresh_generation = 1
+        oauth_client._refresh_lock.acquire()
+        outcome = {}
+
+        def waiter():
+            try:
+                outcome['result'] = oauth_client.refresh_access_token('r')
+            except YahooOAuthError as exc:
+                outcome['error'] = exc
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        # The holder fails without publishing a result
+        oauth_client._refresh_lock.release()
+        thread.join(timeout=5)
+        assert 'result' not in outcome
+        assert 'error' in outcome
+
+    def test_refresh_access_token_no_refresh_token(self, oauth_client,
+                                                   mock_token_manager):
+        mock_token_manager.get_refresh_token.return_value = None
+        with pytest.raises(YahooOAuthError):
+            oauth_client.refresh_access_token()
+
+
+class TestAccessToken:
+    def test_get_access_token_cached(self, oauth_client, mock_token_manager):
+        oauth_client._access_token = 'cached-token'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        assert oauth_client.get_access_token() == 'cached-token'
+        mock_token_manager.get_valid_tokens.assert_not_called()
+
+    def test_get_access_token_from_storage(self, oauth_client,
+                                           mock_token_manager):
+        mock_token_manager.get_valid_tokens.return_value = {
+            'access_token': 'stored-token',
+            'has_refresh_token': True,
+            'expires_at': time.time() + 3600,
+        }
+        assert oauth_client.get_access_token() == 'stored-token'
+        # The storage result is cached in-process: the second call must
+        # not go back to the TokenManager
+        assert oauth_client.get_access_token() == 'stored-token'
+        assert mock_token_manager.get_valid_tokens.call_count == 1
+
+    def test_get_access_token_refreshes_near_expiry(self, oauth_client,
+                                                    mock_token_manager):
+        mock_token_manager.get_valid_tokens.return_value = {
+            'access_token': 'stale-token',
+            'has_refresh_token': True,
+            'expires_at': time.time() + 120,
+        }
+        with patch.object(oauth_client, 'refresh_access_token',
+                          return_value=TOKEN_RESPONSE) as refresh:
+            assert oauth_client.get_access_token() == 'new-access'
+        refresh.assert_called_once()
+
+    def test_get_access_token_not_authenticated(self, oauth_client,
+                                                mock_token_manager):
+        mock_token_manager.get_valid_tokens.return_value = None
+        with pytest.raises(YahooOAuthError):
+            oauth_client.get_access_token()
+
+
+class TestApiRequests:
+    def test_make_api_request_success(self, oauth_client):
+        oauth_client._access_token = 'token'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        with patch.object(
+                oauth_client._session, 'request',
+                return_value=_mock_response(200, {'fantasy_content': {}})
+        ) as mock_request:
+            data = oauth_client.make_api_request('users;use_login=1/games')
+        assert data == {'fantasy_content': {}}
+        headers = mock_request.call_args[1]['headers']
+        assert headers['Authorization'] == 'Bearer token'
+
+    def test_make_api_request_retries_on_401(self, oauth_client,
+                                             mock_token_manager):
+        oauth_client._access_token = 'stale'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        responses = [_mock_response(401), _mock_response(200, {'ok': True})]
+        with patch.object(oauth_client._session, 'request',
+                          side_effect=responses):
+            with patch.object(oauth_client, 'refresh_access_token') as refresh:
+                data = oauth_client.make_api_request('game/mlb')
+        assert data == {'ok': True}
+        refresh.assert_called_once()
+
+    def test_make_api_request_rate_limited(self, oauth_client):
+        oauth_client._access_token = 'token'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        response = _mock_response(429, headers={'Retry-After': '30'})
+        with patch.object(oauth_client._session, 'request',
+                          return_value=response):
+            with pytest.raises(YahooAPIError):
+                oauth_client.make_api_request('game/mlb')
+
+    def test_make_api_request_wraps_transport_errors(self, oauth_client):
+        oauth_client._access_token = 'token'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        with patch.object(oauth_client._session, 'request',
+                          side_effect=requests.ConnectionError('refused')):
+            with pytest.raises(YahooAPIError):
+                oauth_client.make_api_request('game/mlb')
+
+    def test_test_connection_caches_failures(self, oauth_client):
+        oauth_client._access_token = 'token'
+        oauth_client._token_valid_until = time.monotonic() + 3600
+        with patch.object(
+                oauth_client._session, 'request',
+                side_effect=requests.ConnectionError('refused')
+        ) as mock_request:
+            assert oauth_client.test_connection() is False
+            # The failed probe is cached - no second live request
+            assert oauth_client.test_connection() is False
+        assert mock_request.call_count == 1
+
+    def test_test_connection_success(self, oauth_client):
+        with patch.object(oauth_client, 'make_api_request',
+                          return_value={'fantasy_content': {}}):
+            assert oauth_client.test_connection() is True
+
+    def test_test_connection_failure(self, oauth_client):
+        with patch.object(oauth_client, 'make_api_request',
+                          side_effect=YahooAPIError('boom')):
+            assert oauth_client.test_connection() is False
+
+    def test_test_connection_cached(self, oauth_client):
+        with patch.object(oauth_client, 'make_api_request',
+                          return_value={}) as mock_request:
+            assert oauth_client.test_connection() is True
+            assert oauth_client.test_connection() is True
+        assert mock_request.call_count == 1
+
+    def test_test_connection_cache_bypass(self, oauth_client):
+        with patch.object(oauth_client, 'make_api_request',
+                          return_value={}) as mock_request:
+            oauth_client.test_connection()
+            oauth_client.test_connection(max_age=0)
+        assert mock_request.call_count == 2
@@ -21,7 +21,11 @@ fi
 
 # Start both servers
 echo "Starting backend server on port 5000..."
-python backend/src/app.py &
+if [ "$NODE_ENV" = "production" ] || [ "$NODE_ENV" = "staging" ]; then
+    gunicorn -c backend/gunicorn.conf.py --chdir backend/src app:app &
+else
+    python backend/src/app.py &
+fi
 BACKEND_PID=$!
 
 echo "Starting frontend server on port 3000..."